@@ -0,0 +1,57 @@
+"""
+Compare Detector image formation using np.add.at with the
+compiled fused binning path, at 10^6 and 10^7 rays
+
+    python benchmarks/bench_detector.py
+"""
+import timeit
+
+import numpy as np
+
+import temgymbasic.components as comp
+from temgymbasic.rays import Rays
+
+
+def make_rays(n_rays: int, seed: int = 0) -> Rays:
+    rng = np.random.default_rng(seed)
+    data = np.ones((5, n_rays))
+    data[:4] = rng.normal(scale=0.02, size=(4, n_rays))
+    return Rays(
+        data=data,
+        location=0.2,
+        path_length=rng.uniform(size=n_rays),
+        wavelength=0.01,
+    )
+
+
+def add_at_image(detector: comp.Detector, rays: Rays, interfere: bool):
+    out = np.zeros(detector.shape, dtype=detector.image_dtype(interfere))
+    flat_icds, mask = detector._flat_pixel_indices(rays)
+    wavefronts = detector._ray_wavefronts(rays, interfere, mask)
+    np.add.at(out.ravel(), flat_icds, wavefronts)
+    return out
+
+
+def main():
+    detector = comp.Detector(z=0.2, pixel_size=0.0005, shape=(256, 256), rotation=12.)
+    for n_rays in (10 ** 6, 10 ** 7):
+        rays = make_rays(n_rays)
+        for interfere in (False, True):
+            # Warm up the JIT
+            detector.get_image(rays, interfere=interfere)
+            t_add_at = min(timeit.repeat(
+                lambda: add_at_image(detector, rays, interfere), number=1, repeat=3,
+            ))
+            t_fused = min(timeit.repeat(
+                lambda: detector.get_image(rays, interfere=interfere), number=1, repeat=3,
+            ))
+            print(
+                f"{n_rays:>9d} rays interfere={interfere!s:<5} "
+                f"np.add.at {t_add_at * 1e3:8.1f} ms  "
+                f"fused {t_fused * 1e3:8.1f} ms  "
+                f"speedup {t_add_at / t_fused:5.1f}x"
+            )
+
+
+if __name__ == '__main__':
+    main()
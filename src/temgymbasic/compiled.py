@@ -0,0 +1,225 @@
+from typing import (
+    NamedTuple, Optional, Sequence, Tuple, Union, TYPE_CHECKING
+)
+
+import numpy as np
+from numpy.typing import NDArray
+
+from . import BackendT
+from .rays import Rays
+
+if TYPE_CHECKING:
+    from .model import Model
+    from .components import Component
+
+
+class Drift(NamedTuple):
+    """
+    Free-space propagation over a distance along z
+    """
+    distance: float
+
+    def matrix(self) -> NDArray:
+        return np.array(
+            [[1, self.distance, 0, 0,             0],
+             [0, 1,             0, 0,             0],
+             [0, 0,             1, self.distance, 0],
+             [0, 0,             0, 1,             0],
+             [0, 0,             0, 0,             1]],
+            dtype=np.float64,
+        )
+
+
+class ThinLens(NamedTuple):
+    """
+    An ideal (unaberrated) thin lens of focal length f
+    """
+    f: float
+
+    def matrix(self) -> NDArray:
+        return np.array(
+            [[1,           0, 0,           0, 0],
+             [-1 / self.f, 1, 0,           0, 0],
+             [0,           0, 1,           0, 0],
+             [0,           0, -1 / self.f, 1, 0],
+             [0,           0, 0,           0, 1]],
+            dtype=np.float64,
+        )
+
+
+class Deflection(NamedTuple):
+    """
+    A constant kick to the ray slopes, in slope units
+    """
+    defx: float
+    defy: float
+
+    def matrix(self) -> NDArray:
+        return np.array(
+            [[1, 0, 0, 0, 0],
+             [0, 1, 0, 0, self.defx],
+             [0, 0, 1, 0, 0],
+             [0, 0, 0, 1, self.defy],
+             [0, 0, 0, 0, 1]],
+            dtype=np.float64,
+        )
+
+
+LinearOp = Union[Drift, ThinLens, Deflection]
+
+
+class LinearSegment:
+    """
+    A run of linear operations folded into a single transfer matrix
+
+    The path length accumulated along the segment is not linear in the
+    ray coordinates, but each contribution is a function of a handful
+    of linear combinations of the incoming ray (the slopes entering each
+    drift and the positions at each lens). These combinations are stacked
+    as extra rows below the 5x5 transfer matrix so that the new ray
+    coordinates and all path length terms come out of one matmul.
+    """
+    def __init__(self, ops: Sequence[LinearOp], z: float):
+        self.ops = tuple(ops)
+        # z position the rays are left at after the segment
+        self.z = z
+
+        transfer = np.eye(5, dtype=np.float64)
+        drift_probes = []
+        drift_distances = []
+        lens_probes = []
+        lens_weights = []
+        for op in self.ops:
+            if isinstance(op, Drift):
+                if op.distance == 0.:
+                    continue
+                drift_probes.extend((transfer[1], transfer[3]))
+                drift_distances.append(op.distance)
+            elif isinstance(op, ThinLens):
+                lens_probes.extend((transfer[0], transfer[2]))
+                lens_weights.append(-1 / (2 * op.f))
+            transfer = op.matrix() @ transfer
+
+        self.transfer = transfer
+        self._n_drift = len(drift_distances)
+        self._drift_distances = np.asarray(drift_distances, dtype=np.float64)
+        self._lens_weights = np.asarray(lens_weights, dtype=np.float64)
+        self._stacked = np.concatenate(
+            (
+                transfer,
+                np.asarray(drift_probes, dtype=np.float64).reshape(-1, 5),
+                np.asarray(lens_probes, dtype=np.float64).reshape(-1, 5),
+            ),
+            axis=0,
+        )
+
+    @property
+    def is_identity(self) -> bool:
+        return self._stacked.shape[0] == 5 and (self.transfer == np.eye(5)).all()
+
+    def apply(self, rays: Rays) -> Rays:
+        xp = rays.xp
+        result = xp.matmul(
+            xp.asarray(self._stacked, dtype=rays.data.dtype),
+            rays.data,
+        )
+        path_length = rays.path_length.copy()
+
+        # Rows 5: onwards hold (dx, dy) pairs entering each drift
+        # followed by (x, y) pairs at each lens
+        n_drift_rows = 2 * self._n_drift
+        if n_drift_rows:
+            slopes = result[5:5 + n_drift_rows].reshape(self._n_drift, 2, -1)
+            path_length += (
+                xp.asarray(self._drift_distances)[:, xp.newaxis]
+                * (1 + slopes[:, 0] ** 2 + slopes[:, 1] ** 2) ** 0.5
+            ).sum(axis=0)
+        if self._lens_weights.size:
+            positions = result[5 + n_drift_rows:].reshape(self._lens_weights.size, 2, -1)
+            path_length += (
+                xp.asarray(self._lens_weights)[:, xp.newaxis]
+                * (positions[:, 0] ** 2 + positions[:, 1] ** 2)
+            ).sum(axis=0)
+
+        return rays.new_with(
+            data=result[:5],
+            location=self.z,
+            path_length=path_length,
+        )
+
+
+class CompiledModel:
+    """
+    A Model where each run of linear components (and the drifts between
+    them) is folded into a precomputed :class:`LinearSegment`, falling back
+    to the component's own step method for non-linear components.
+
+    The compiled form is rebuilt automatically whenever a component
+    parameter, component position or the set of components in the model
+    changes.
+    """
+    def __init__(self, model: 'Model'):
+        self._model = model
+        self._key = None
+        self._items: Tuple[Union[LinearSegment, 'Component'], ...] = tuple()
+        self.update()
+
+    @property
+    def model(self) -> 'Model':
+        return self._model
+
+    @property
+    def items(self) -> Tuple[Union[LinearSegment, 'Component'], ...]:
+        self.update()
+        return self._items
+
+    @property
+    def stale(self) -> bool:
+        return self._key != self._model._compile_key()
+
+    def update(self):
+        if not self.stale:
+            return
+        self._key = self._model._compile_key()
+        self._items = self._compile(self._model.components)
+
+    @staticmethod
+    def _compile(
+        components: Sequence['Component']
+    ) -> Tuple[Union[LinearSegment, 'Component'], ...]:
+        items = []
+        ops = []
+        exit_z = components[0].z
+        for idx, component in enumerate(components):
+            ops.append(Drift(component.entrance_z - exit_z))
+            linear_ops = component.linear_ops()
+            # The final component is always stepped so that the
+            # returned rays carry the same location as run_to_end
+            if linear_ops is None or idx == len(components) - 1:
+                segment = LinearSegment(ops, z=component.entrance_z)
+                if not segment.is_identity:
+                    items.append(segment)
+                items.append(component)
+                ops = []
+            else:
+                ops.extend(linear_ops)
+            exit_z = component.exit_z
+        return tuple(items)
+
+    def run_to_end(
+        self,
+        num_rays: int,
+        random: Optional[bool] = None,
+        backend: Optional[BackendT] = None,
+    ) -> Rays:
+        self.update()
+        rays = self._model.source.get_rays(
+            num_rays, random=random, backend=backend or self._model.backend
+        )
+        for item in self._items:
+            if isinstance(item, LinearSegment):
+                rays = item.apply(rays)
+            else:
+                for rays in item.step(rays):
+                    pass
+        return rays
@@ -0,0 +1,84 @@
+import os
+from typing import Tuple, Union
+
+import numpy as np
+from numpy.typing import NDArray, DTypeLike
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+from . import UsageError
+
+
+PathT = Union[str, os.PathLike]
+
+
+def get_zarr():
+    """
+    Get zarr, previously imported
+
+    If not available raises ModuleNotFoundError
+    """
+    if zarr is None:
+        raise ModuleNotFoundError("Cannot write .zarr datacube, zarr not found")
+    return zarr
+
+
+def open_datacube(
+    path: PathT,
+    shape: Tuple[int, int, int, int],
+    dtype: DTypeLike,
+):
+    """
+    Create a 4D datacube on disk to be filled frame by frame
+
+    A path ending in .zarr creates a zarr array chunked by frame
+    (requires zarr), any other path creates an .npy file opened
+    as a writeable memory map. An existing file is overwritten.
+    """
+    path = os.fspath(path)
+    if path.endswith('.zarr'):
+        return get_zarr().open(
+            path,
+            mode='w',
+            shape=shape,
+            chunks=(1, 1, *shape[2:]),
+            dtype=dtype,
+        )
+    return np.lib.format.open_memmap(
+        path,
+        mode='w+',
+        shape=shape,
+        dtype=dtype,
+    )
+
+
+def check_datacube(out, shape: Tuple[int, ...], dtype: DTypeLike):
+    if tuple(out.shape) != tuple(shape):
+        raise UsageError(
+            f"Output datacube has shape {tuple(out.shape)}, expected {tuple(shape)}"
+        )
+    if np.dtype(out.dtype) != np.dtype(dtype):
+        raise UsageError(
+            f"Output datacube has dtype {out.dtype}, expected {np.dtype(dtype)}"
+        )
+
+
+def write_frames(out, start: int, frames: NDArray):
+    """
+    Write a block of frames into out, a (sy, sx, dy, dx) array-like,
+    starting from the flat (C-order) scan index start
+
+    Only basic slicing over the first two axes is used, one
+    slice per scan row touched, so that out can be any of
+    numpy array, memmap, h5py.Dataset or zarr.Array.
+    """
+    sx = out.shape[1]
+    written = 0
+    while written < frames.shape[0]:
+        y, x = divmod(start + written, sx)
+        n = min(sx - x, frames.shape[0] - written)
+        out[y, x:x + n] = frames[written:written + n]
+        written += n
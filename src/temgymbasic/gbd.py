@@ -1,4 +1,5 @@
 import numpy as np
+from numba import njit, prange
 
 
 def differential_matrix(rayset, dPx, dPy, dHx, dHy, xp=np):
@@ -324,3 +325,162 @@ def propagate_misaligned_gaussian(
     # return aligned.sum(axis=-1)
     # (n_px,): complex
     # return field
+
+
+# Approximate peak bytes of temporaries per (pixel, beamlet) pair
+# in propagate_misaligned_gaussian: detector coordinates relative to
+# each beamlet, several real phase terms and the complex field
+GBD_BYTES_PER_ELEMENT = 128
+GBD_DEFAULT_MEMORY = 256 * 2 ** 20
+
+
+def gbd_block_sizes(n_px, n_gauss, max_memory, bytes_per_element=GBD_BYTES_PER_ELEMENT):
+    """
+    Choose (pixel_block, gauss_block) so that a (pixel_block, gauss_block)
+    tile of temporaries fits in max_memory bytes
+
+    Pixels are tiled first as this does not change the order of the sum over
+    beamlets, beamlets are only split when a single row of pixels will not fit
+    """
+    max_elements = max(1, int(max_memory // bytes_per_element))
+    gauss_block = max(1, min(n_gauss, max_elements))
+    px_block = max(1, min(n_px, max_elements // gauss_block))
+    return px_block, gauss_block
+
+
+def propagate_misaligned_gaussian_tiled(
+    Qinv,
+    Qpinv,
+    det_x,
+    det_y,
+    end_xy,
+    rho_1m,
+    theta2m,
+    k,
+    A,
+    B,
+    path_length,
+    out,
+    max_memory=GBD_DEFAULT_MEMORY,
+    xp=np
+):
+    # As propagate_misaligned_gaussian but building the detector coordinates
+    # relative to each beamlet one (pixel block, beamlet block) tile at a time
+    # and accumulating each tile into the matching slice of out
+    # det_x: (n0,), det_y: (n1,) => detector axes, pixel p is at
+    #   (det_x[p % n0], det_y[p // n0]) as from meshgrid(det_x, det_y)
+    # end_xy: (n_gauss, 2:[x, y]) => final central ray positions
+    # out: (n0 * n1,), complex
+    n0 = det_x.shape[0]
+    n_px = out.shape[0]
+    n_gauss = end_xy.shape[0]
+    px_block, gauss_block = gbd_block_sizes(n_px, n_gauss, max_memory)
+
+    for p0 in range(0, n_px, px_block):
+        p1 = min(p0 + px_block, n_px)
+        px_idx = xp.arange(p0, p1)
+        r = xp.stack((det_x[px_idx % n0], det_y[px_idx // n0]), axis=-1)
+        for g0 in range(0, n_gauss, gauss_block):
+            gs = slice(g0, g0 + gauss_block)
+            propagate_misaligned_gaussian(
+                Qinv[gs],
+                Qpinv[gs],
+                r[:, xp.newaxis, :] - end_xy[xp.newaxis, gs, :],
+                rho_1m[gs],
+                theta2m[gs],
+                k,
+                A[gs],
+                B[gs],
+                path_length[gs],
+                out[p0:p1],
+                xp=xp,
+            )
+
+
+def propagate_misaligned_gaussian_fused(
+    Qinv,
+    Qpinv,
+    det_x,
+    det_y,
+    end_xy,
+    rho_1m,
+    theta2m,
+    k,
+    A,
+    B,
+    path_length,
+    out,
+):
+    # Equivalent to propagate_misaligned_gaussian_tiled, but evaluated
+    # by a compiled kernel which loops over beamlets for each pixel
+    # and reduces into the pixel directly, so no (n_px, n_gauss)
+    # temporaries are created at all. Only the per-beamlet terms
+    # are precomputed here with numpy. CPU (numpy) arrays only.
+    # All of the phase terms are linear or quadratic in the pixel
+    # position relative to the beamlet, r = (x, y) - end_xy, so are
+    # reduced to per-beamlet coefficients:
+    #   transversal_phase: (r0**2 * Qpinv00 + r1**2 * Qpinv11) / 2
+    #   misalign_phase_plane_wave: r0 * t0 * (1 + t0**2 / 2) + (same for y)
+    #   extra_factors: misalign + cross, cross = -2 * (c0 * r0 + c1 * r1)
+    rho = -rho_1m
+    Binv = np.linalg.inv(B)
+    BA = Binv @ A
+    misalign = (rho[..., 0]*BA[..., 0, 0] + rho[..., 1]*BA[..., 1, 0])*rho[..., 0]
+    misalign = (misalign + (rho[..., 0]*BA[..., 0, 1] + rho[..., 1]*BA[..., 1, 1])*rho[..., 1])
+    cross_x = rho[..., 0]*Binv[..., 0, 0] + rho[..., 1]*Binv[..., 1, 0]
+    cross_y = rho[..., 0]*Binv[..., 0, 1] + rho[..., 1]*Binv[..., 1, 1]
+
+    _misaligned_gaussian_kernel(
+        out,
+        np.ascontiguousarray(det_x),
+        np.ascontiguousarray(det_y),
+        np.ascontiguousarray(end_xy[:, 0]),
+        np.ascontiguousarray(end_xy[:, 1]),
+        np.ascontiguousarray(Qpinv[:, 0, 0]),
+        np.ascontiguousarray(Qpinv[:, 1, 1]),
+        np.ascontiguousarray(theta2m[:, 0]),
+        np.ascontiguousarray(theta2m[:, 1]),
+        cross_x,
+        cross_y,
+        misalign,
+        np.ascontiguousarray(path_length),
+        guoy_phase(Qpinv),
+        np.abs(gaussian_amplitude(Qinv, A, B)),
+        k,
+    )
+
+
+@njit(parallel=True, cache=True)
+def _misaligned_gaussian_kernel(
+    out, det_x, det_y, end_x, end_y, q00, q11, theta_x, theta_y,
+    cross_x, cross_y, misalign, path_length, guoy, amplitude, k,
+):
+    # The order of operations follows propagate_misaligned_gaussian
+    n0 = det_x.size
+    n_gauss = end_x.size
+    for p in prange(out.size):
+        x = det_x[p % n0]
+        y = det_y[p // n0]
+        acc_re = 0.
+        acc_im = 0.
+        for g in range(n_gauss):
+            r0 = x - end_x[g]
+            r1 = y - end_y[g]
+            r0_sq = r0 * r0
+            r1_sq = r1 * r1
+            # imag part of 1j * k * transversal is real(transversal)
+            phase = (r0_sq * q00[g].real) / 2 + (r1_sq * q11[g].real) / 2
+            decay = (r0_sq * q00[g].imag) / 2 + (r1_sq * q11[g].imag) / 2
+            extra = misalign[g] + -2 * (cross_x[g] * r0 + cross_y[g] * r1)
+            mis = (
+                r0 * theta_x[g] * (1 + ((theta_x[g] ** 2) / 2))
+                + r1 * theta_y[g] * (1 + ((theta_y[g] ** 2) / 2))
+            )
+            phase += extra / 2
+            phase += mis
+            phase += path_length[g]
+            phase = phase * k - guoy[g]
+            mag = np.exp(-decay * k) * amplitude[g]
+            acc_re += mag * np.cos(phase)
+            acc_im += mag * np.sin(phase)
+        out[p] += acc_re + 1j * acc_im
@@ -1,398 +1,774 @@
-from typing import (
-    Generator, Sequence, Tuple, Optional
-)
-from typing_extensions import Self
-
-from . import (
-    PositiveFloat,
-    UsageError,
-    InvalidModelError,
-)
-from . import components as comp, Degrees, BackendT
-from .rays import Rays
-from .utils import pairwise
-import numpy as np
-
-
-class Model:
-    def __init__(
-        self,
-        components: Sequence[comp.Component],
-        backend: BackendT = 'cpu'
-    ):
-        self.backend = backend
-        self._components = components
-
-        self._sort_components()
-        self._validate_components()
-
-    def _validate_components(self):
-        if len(self._components) <= 1:
-            raise InvalidModelError("Must have at least one component")
-        if not isinstance(self.source, comp.Source):
-            raise InvalidModelError("First component must always be a Source")
-        if any(
-            next_c.entrance_z <= this_c.exit_z
-            for this_c, next_c
-            in pairwise(self._components)
-        ):
-            raise InvalidModelError(
-                "Components must be sorted in increasing in z position with no overlap"
-            )
-        for c in self._components:
-            c._validate_component()
-
-    @property
-    def components(self) -> Sequence[comp.Component]:
-        return self._components
-
-    def __repr__(self):
-        repr_string = f'[{self.__class__.__name__}]:'
-        for component in self.components:
-            repr_string = repr_string + f'\n - {repr(component)}'
-        return repr_string
-
-    @property
-    def source(self) -> comp.Source:
-        return self.components[0]
-
-    @property
-    def detector(self) -> Optional[comp.Detector]:
-        if isinstance(self.last, comp.Detector):
-            return self.last
-        return None
-
-    @property
-    def last(self) -> comp.Detector:
-        return self.components[-1]
-
-    def set_backend_for_components(self, backend):
-        for component in self.components:
-            component.set_backend(backend)
-
-    def move_component(
-        self,
-        component: comp.Component,
-        z: float,
-    ):
-        old_z = component.z
-        component._set_z(z)
-        self._sort_components()
-        try:
-            self._validate_components()
-        except InvalidModelError as err:
-            # Unwind the change but reraise
-            self.move_component(component, old_z)
-            raise err from None
-
-    def add_component(self, component: comp.Component):
-        original_components = tuple(self._components)
-        self._components = tuple(self._components) + (component,)
-        self._sort_components()
-        try:
-            self._validate_components()
-        except InvalidModelError as err:
-            # Unwind the change but reraise
-            self._components = original_components
-            raise err from None
-
-    def remove_component(self, component: comp.Component):
-        original_components = tuple(self._components)
-        self._components = tuple(
-            c for c in self._components
-            if c is not component
-        )
-        if len(self._components) == len(original_components):
-            raise ValueError("Component not found in model, cannot remove")
-        try:
-            self._validate_components()
-        except InvalidModelError as err:
-            # Unwind the change but reraise
-            self._components = original_components
-            raise err from None
-
-    def _sort_components(self):
-        self._components = tuple(
-            sorted(self._components, key=lambda c: c.z)
-        )
-
-    def run_iter(
-        self, num_rays: int, random: Optional[bool] = None, backend: Optional[BackendT] = None,
-    ) -> Generator[Rays, None, None]:
-        source: comp.Source = self.components[0]
-        rays = source.get_rays(num_rays, random=random, backend=backend or self.backend)
-
-        for component in self.components:
-            rays = rays.propagate_to(component.entrance_z)
-            for rays in component.step(rays):
-                # Could use generator with return value here...
-                yield rays
-
-    def run_to_z(
-        self, num_rays: int, z: float, backend: Optional[BackendT] = None
-    ) -> Optional[Rays]:
-        """
-        Get the rays at a point z
-
-        If z is the position of a component, this returns the rays before the
-        component affects the rays. To get the rays just after the component
-        use 'run_to_component' instead.
-        """
-        last_rays = None
-        for rays in self.run_iter(num_rays, backend=backend):
-            if last_rays is not None and (last_rays.z < z <= rays.z):
-                return last_rays.propagate_to(z)
-            last_rays = rays
-        return None
-
-    def run_to_end(self, num_rays: int, backend: Optional[BackendT] = None) -> Rays:
-        for rays in self.run_iter(num_rays, backend=backend):
-            pass
-        return rays
-
-    def run_to_component(
-        self,
-        component: comp.Component,
-        num_rays: int,
-        backend: Optional[BackendT] = None
-    ) -> Optional[Rays]:
-        for rays in self.run_iter(num_rays, backend=backend):
-            if rays.component is component:
-                return rays
-        return None
-
-    @staticmethod
-    def gui_wrapper():
-        from .gui import ModelGUI
-        return ModelGUI
-
-
-class STEMModel(Model):
-    def __init__(self, backend: str = 'cpu'):
-        # Note a flip_y or flip_x can be achieved by setting
-        # either of scan_step_yx to negative values
-        self._scan_pixel_yx = (0, 0)  # Maybe should live on STEMSample
-        super().__init__(self.default_components(), backend=backend)
-        self.set_stem_params()
-
-    def _validate_components(self):
-        super()._validate_components()
-        if not isinstance(self.source, comp.ParallelBeam):
-            raise InvalidModelError("Must have a ParallelBeam for STEMModel")
-        # Called here because even if all components are valid from
-        # the perspective of z the current overfocus/semiconv
-        # could forbid the new state, so we change the state during
-        # validation such that it could be unwound if necessary
-        self.set_stem_params()
-
-    def _sort_components(self):
-        """Component order fixed in STEMModel"""
-        pass
-
-    def add_component(self, component: comp.Component):
-        raise UsageError("Cannot add components to STEMModel")
-
-    def remove_component(self, component: comp.Component):
-        raise UsageError("Cannot remove components from STEMModel")
-
-    @staticmethod
-    def default_components():
-        """
-        Just an initial valid state for the model
-        """
-        return (
-            comp.ParallelBeam(
-                z=0.0,
-                radius=0.01,
-                voltage=1.0,
-            ),
-            comp.DoubleDeflector(
-                first=comp.Deflector(z=0.1, name='Upper'),
-                second=comp.Deflector(z=0.15, name='Lower'),
-                name='Scan Coil',
-            ),
-            comp.Lens(
-                z=0.3,
-                f=0.1,
-            ),
-            comp.STEMSample(
-                z=0.5,
-                name='STEM Sample'
-            ),
-            comp.DoubleDeflector(
-                first=comp.Deflector(z=0.6, name='Upper'),
-                second=comp.Deflector(z=0.625, name='Lower'),
-                name='Descan Coil',
-            ),
-            comp.Detector(
-                z=1.,
-                pixel_size=0.001,
-                shape=(128, 128),
-            ),
-        )
-
-    @property
-    def source(self) -> comp.ParallelBeam:
-        return self.components[0]
-
-    @property
-    def scan_coils(self) -> comp.DoubleDeflector:
-        return self.components[1]
-
-    @property
-    def objective(self) -> comp.Lens:
-        return self.components[2]
-
-    @property
-    def sample(self) -> comp.STEMSample:
-        return self.components[3]
-
-    @property
-    def descan_coils(self) -> comp.DoubleDeflector:
-        return self.components[4]
-
-    @property
-    def scan_coord(self) -> Tuple[int, int]:
-        return self._scan_pixel_yx
-
-    @scan_coord.setter
-    def scan_coord(self, scan_pixel_yx: Tuple[int, int]):
-        self._scan_pixel_yx = scan_pixel_yx
-        self.move_to(self.scan_coord)
-
-    def set_stem_params(
-        self,
-        *,
-        overfocus: Optional[float] = None,
-        semiconv_angle: Optional[PositiveFloat] = None,
-        scan_step_yx: Optional[Tuple[PositiveFloat, PositiveFloat]] = None,
-        scan_shape: Optional[Tuple[int, int]] = None,
-        scan_rotation: Optional['Degrees'] = None,
-        camera_length: Optional[float] = None,
-    ) -> Self:
-        """
-        Change one-or-more STEM params
-
-        This must be the endpoint that is used to keep the
-        model in a valid state, as all the potential input parameters
-        eventually affect the coil deflection values
-
-        The other method is `move_to` to set the current scan position.
-        Neither method requires that the current scan coordinate is actually
-        within the scan grid.
-        """
-        if overfocus is not None:
-            self.sample.overfocus = overfocus
-        if semiconv_angle is not None:
-            self.sample.semiconv_angle = semiconv_angle
-        self.set_obj_lens_f_from_overfocus()
-        self.set_beam_radius_from_semiconv()
-        if scan_step_yx is not None:
-            self.sample.scan_step_yx = scan_step_yx
-        if scan_shape is not None:
-            self.sample.scan_shape = scan_shape
-        if scan_rotation is not None:
-            self.sample.scan_rotation = scan_rotation
-        if camera_length is not None:
-            self.move_component(
-                self.detector,
-                self.sample.z + camera_length
-            )
-        self.move_to(self.scan_coord)
-        return self
-
-    @property
-    def camera_length(self) -> float:
-        return self.detector.z - self.sample.z
-
-    def set_obj_lens_f_from_overfocus(self):
-        if self.sample.overfocus > (self.sample.z - self.objective.z):
-            raise InvalidModelError("Overfocus point is before lens")
-        self.objective.f = self._get_objective_f(self.sample.overfocus)
-
-    def _get_objective_f(self, overfocus: float):
-        return self.sample.z - (self.objective.z + overfocus)
-
-    def _overfocus_bounds(self):
-        # for each change to scan step or shape or rotation
-        # get max def values from corners and set def slider min/max
-        # foreach change in sample z or objective z get overfocus max,
-        # set minimum to minus max, calculate and set min/max objective f slider
-        # also set min/max beam radius to be in sync whatever they are
-        # could have a signal for geom changed which components could connect to
-        upper = self.sample.z - self.objective.z
-        return (None, (upper * 0.99))
-
-    def _minmax_def(self):
-        current_coord = self._scan_pixel_yx
-        ny, nx = self.sample.scan_shape
-        values = []
-        for c in (
-            (0, 0),
-            (ny, 0),
-            (0, nx),
-            (ny, nx),
-        ):
-            self.move_to(c)
-            values.append(
-                (
-                    self.scan_coils.first.defy,
-                    self.scan_coils.first.defx,
-                    self.scan_coils.second.defy,
-                    self.scan_coils.second.defx,
-                    self.descan_coils.first.defy,
-                    self.descan_coils.first.defx,
-                    self.descan_coils.second.defy,
-                    self.descan_coils.second.defx,
-                )
-            )
-        values = np.stack(values, axis=0)
-        self.move_to(current_coord)
-        return values.min(axis=0), values.max(axis=0)
-
-    def set_beam_radius_from_semiconv(self):
-        self.source.radius = self._get_radius(self.sample.semiconv_angle)
-
-    def _get_radius(self, semiconv: float):
-        return abs(self.objective.f) * np.tan(abs(semiconv))
-
-    def move_to(self, scan_pixel_yx: Tuple[int, int]):
-        self._scan_pixel_yx = scan_pixel_yx
-        scan_position = self.sample.scan_position(scan_pixel_yx)
-        centerline = (0., 0.)
-        exit_axis = self.detector.center
-
-        self.scan_coils.send_ray_through_points(
-            centerline,
-            (self.objective.ffp, *centerline),
-            (self.objective.z, *scan_position),
-        )
-        self.descan_coils.send_ray_through_points(
-            scan_position,
-            (self.descan_coils.second.z + 0.01, *exit_axis),
-            (self.descan_coils.second.z + 0.02, *exit_axis),
-        )
-
-    def scan_point(self, num_rays: int, yx: Tuple[int, int]) -> Rays:
-        self.move_to(yx)
-        return self.run_to_end(num_rays)
-
-    def scan_point_iter(
-        self, num_rays: int, yx: Tuple[int, int]
-    ) -> Generator[Rays, None, None]:
-        self.move_to(yx)
-        yield from self.run_iter(num_rays)
-
-    def scan(
-        self, num_rays: int
-    ) -> Generator[Tuple[Tuple[int, int], Rays], None, None]:
-        sy, sx = self.sample.scan_shape
-        for y in range(sy):
-            for x in range(sx):
-                pos = (y, x)
-                yield pos, self.scan_point(num_rays, pos)
-
-    @staticmethod
-    def gui_wrapper():
-        from .gui import STEMModelGUI
-        return STEMModelGUI
+import os
+import pickle
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from typing import (
+    Generator, Sequence, Tuple, Optional, Union
+)
+from typing_extensions import Self
+
+from numpy.typing import NDArray
+
+from . import (
+    PositiveFloat,
+    UsageError,
+    InvalidModelError,
+)
+from . import components as comp, Degrees, BackendT
+from .compiled import CompiledModel
+from .datacube import PathT, open_datacube, check_datacube, write_frames
+from .rays import Rays
+from .utils import pairwise, get_array_from_device
+import numpy as np
+
+
+# Rough upper bound on the working memory needed per ray per
+# scan position when tracing batches of scan positions together,
+# covering the ray data, path length and the temporaries created
+# by propagation and detector imaging
+BATCH_BYTES_PER_RAY = 256
+DEFAULT_BATCH_MEMORY = 512 * 2 ** 20
+
+
+class Model:
+    def __init__(
+        self,
+        components: Sequence[comp.Component],
+        backend: BackendT = 'cpu'
+    ):
+        self.backend = backend
+        self._components = components
+        self._compiled: Optional[CompiledModel] = None
+
+        self._sort_components()
+        self._validate_components()
+
+    def _validate_components(self):
+        if len(self._components) <= 1:
+            raise InvalidModelError("Must have at least one component")
+        if not isinstance(self.source, comp.Source):
+            raise InvalidModelError("First component must always be a Source")
+        if any(
+            next_c.entrance_z <= this_c.exit_z
+            for this_c, next_c
+            in pairwise(self._components)
+        ):
+            raise InvalidModelError(
+                "Components must be sorted in increasing in z position with no overlap"
+            )
+        for c in self._components:
+            c._validate_component()
+
+    @property
+    def components(self) -> Sequence[comp.Component]:
+        return self._components
+
+    def __repr__(self):
+        repr_string = f'[{self.__class__.__name__}]:'
+        for component in self.components:
+            repr_string = repr_string + f'\n - {repr(component)}'
+        return repr_string
+
+    @property
+    def source(self) -> comp.Source:
+        return self.components[0]
+
+    @property
+    def detector(self) -> Optional[comp.Detector]:
+        if isinstance(self.last, comp.Detector):
+            return self.last
+        return None
+
+    @property
+    def last(self) -> comp.Detector:
+        return self.components[-1]
+
+    def set_backend_for_components(self, backend):
+        for component in self.components:
+            component.set_backend(backend)
+
+    def move_component(
+        self,
+        component: comp.Component,
+        z: float,
+    ):
+        old_z = component.z
+        component._set_z(z)
+        self._sort_components()
+        try:
+            self._validate_components()
+        except InvalidModelError as err:
+            # Unwind the change but reraise
+            self.move_component(component, old_z)
+            raise err from None
+
+    def add_component(self, component: comp.Component):
+        original_components = tuple(self._components)
+        self._components = tuple(self._components) + (component,)
+        self._sort_components()
+        try:
+            self._validate_components()
+        except InvalidModelError as err:
+            # Unwind the change but reraise
+            self._components = original_components
+            raise err from None
+
+    def remove_component(self, component: comp.Component):
+        original_components = tuple(self._components)
+        self._components = tuple(
+            c for c in self._components
+            if c is not component
+        )
+        if len(self._components) == len(original_components):
+            raise ValueError("Component not found in model, cannot remove")
+        try:
+            self._validate_components()
+        except InvalidModelError as err:
+            # Unwind the change but reraise
+            self._components = original_components
+            raise err from None
+
+    def _sort_components(self):
+        self._components = tuple(
+            sorted(self._components, key=lambda c: c.z)
+        )
+
+    def _compile_key(self):
+        # Components are compared by identity so this key changes
+        # when components are added, removed or re-ordered, and
+        # the versions change when any component parameter or z is set
+        return tuple(
+            (c, c.version) for c in self.components
+        )
+
+    def compile(self) -> CompiledModel:
+        """
+        Get a CompiledModel for this model, where runs of linear
+        components are folded into single transfer matrices
+
+        The returned object tracks this model and recompiles itself
+        whenever the model is changed, so it can be kept and re-used.
+        """
+        if self._compiled is None:
+            self._compiled = CompiledModel(self)
+        self._compiled.update()
+        return self._compiled
+
+    def run_iter(
+        self, num_rays: int, random: Optional[bool] = None, backend: Optional[BackendT] = None,
+    ) -> Generator[Rays, None, None]:
+        source: comp.Source = self.components[0]
+        rays = source.get_rays(num_rays, random=random, backend=backend or self.backend)
+
+        for component in self.components:
+            rays = rays.propagate_to(component.entrance_z)
+            for rays in component.step(rays):
+                # Could use generator with return value here...
+                yield rays
+
+    def run_to_z(
+        self, num_rays: int, z: float, backend: Optional[BackendT] = None
+    ) -> Optional[Rays]:
+        """
+        Get the rays at a point z
+
+        If z is the position of a component, this returns the rays before the
+        component affects the rays. To get the rays just after the component
+        use 'run_to_component' instead.
+        """
+        last_rays = None
+        for rays in self.run_iter(num_rays, backend=backend):
+            if last_rays is not None and (last_rays.z < z <= rays.z):
+                return last_rays.propagate_to(z)
+            last_rays = rays
+        return None
+
+    def run_to_end(self, num_rays: int, backend: Optional[BackendT] = None) -> Rays:
+        for rays in self.run_iter(num_rays, backend=backend):
+            pass
+        return rays
+
+    def run_to_component(
+        self,
+        component: comp.Component,
+        num_rays: int,
+        backend: Optional[BackendT] = None
+    ) -> Optional[Rays]:
+        for rays in self.run_iter(num_rays, backend=backend):
+            if rays.component is component:
+                return rays
+        return None
+
+    @staticmethod
+    def gui_wrapper():
+        from .gui import ModelGUI
+        return ModelGUI
+
+
+class STEMModel(Model):
+    def __init__(self, backend: str = 'cpu'):
+        # Note a flip_y or flip_x can be achieved by setting
+        # either of scan_step_yx to negative values
+        self._scan_pixel_yx = (0, 0)  # Maybe should live on STEMSample
+        super().__init__(self.default_components(), backend=backend)
+        self.set_stem_params()
+
+    def _validate_components(self):
+        super()._validate_components()
+        if not isinstance(self.source, comp.ParallelBeam):
+            raise InvalidModelError("Must have a ParallelBeam for STEMModel")
+        # Called here because even if all components are valid from
+        # the perspective of z the current overfocus/semiconv
+        # could forbid the new state, so we change the state during
+        # validation such that it could be unwound if necessary
+        self.set_stem_params()
+
+    def _sort_components(self):
+        """Component order fixed in STEMModel"""
+        pass
+
+    def add_component(self, component: comp.Component):
+        raise UsageError("Cannot add components to STEMModel")
+
+    def remove_component(self, component: comp.Component):
+        raise UsageError("Cannot remove components from STEMModel")
+
+    @staticmethod
+    def default_components():
+        """
+        Just an initial valid state for the model
+        """
+        return (
+            comp.ParallelBeam(
+                z=0.0,
+                radius=0.01,
+                voltage=1.0,
+            ),
+            comp.DoubleDeflector(
+                first=comp.Deflector(z=0.1, name='Upper'),
+                second=comp.Deflector(z=0.15, name='Lower'),
+                name='Scan Coil',
+            ),
+            comp.Lens(
+                z=0.3,
+                f=0.1,
+            ),
+            comp.STEMSample(
+                z=0.5,
+                name='STEM Sample'
+            ),
+            comp.DoubleDeflector(
+                first=comp.Deflector(z=0.6, name='Upper'),
+                second=comp.Deflector(z=0.625, name='Lower'),
+                name='Descan Coil',
+            ),
+            comp.Detector(
+                z=1.,
+                pixel_size=0.001,
+                shape=(128, 128),
+            ),
+        )
+
+    @property
+    def source(self) -> comp.ParallelBeam:
+        return self.components[0]
+
+    @property
+    def scan_coils(self) -> comp.DoubleDeflector:
+        return self.components[1]
+
+    @property
+    def objective(self) -> comp.Lens:
+        return self.components[2]
+
+    @property
+    def sample(self) -> comp.STEMSample:
+        return self.components[3]
+
+    @property
+    def descan_coils(self) -> comp.DoubleDeflector:
+        return self.components[4]
+
+    @property
+    def scan_coord(self) -> Tuple[int, int]:
+        return self._scan_pixel_yx
+
+    @scan_coord.setter
+    def scan_coord(self, scan_pixel_yx: Tuple[int, int]):
+        self._scan_pixel_yx = scan_pixel_yx
+        self.move_to(self.scan_coord)
+
+    def set_stem_params(
+        self,
+        *,
+        overfocus: Optional[float] = None,
+        semiconv_angle: Optional[PositiveFloat] = None,
+        scan_step_yx: Optional[Tuple[PositiveFloat, PositiveFloat]] = None,
+        scan_shape: Optional[Tuple[int, int]] = None,
+        scan_rotation: Optional['Degrees'] = None,
+        camera_length: Optional[float] = None,
+    ) -> Self:
+        """
+        Change one-or-more STEM params
+
+        This must be the endpoint that is used to keep the
+        model in a valid state, as all the potential input parameters
+        eventually affect the coil deflection values
+
+        The other method is `move_to` to set the current scan position.
+        Neither method requires that the current scan coordinate is actually
+        within the scan grid.
+        """
+        if overfocus is not None:
+            self.sample.overfocus = overfocus
+        if semiconv_angle is not None:
+            self.sample.semiconv_angle = semiconv_angle
+        self.set_obj_lens_f_from_overfocus()
+        self.set_beam_radius_from_semiconv()
+        if scan_step_yx is not None:
+            self.sample.scan_step_yx = scan_step_yx
+        if scan_shape is not None:
+            self.sample.scan_shape = scan_shape
+        if scan_rotation is not None:
+            self.sample.scan_rotation = scan_rotation
+        if camera_length is not None:
+            self.move_component(
+                self.detector,
+                self.sample.z + camera_length
+            )
+        self.move_to(self.scan_coord)
+        return self
+
+    @property
+    def camera_length(self) -> float:
+        return self.detector.z - self.sample.z
+
+    def set_obj_lens_f_from_overfocus(self):
+        if self.sample.overfocus > (self.sample.z - self.objective.z):
+            raise InvalidModelError("Overfocus point is before lens")
+        self.objective.f = self._get_objective_f(self.sample.overfocus)
+
+    def _get_objective_f(self, overfocus: float):
+        return self.sample.z - (self.objective.z + overfocus)
+
+    def _overfocus_bounds(self):
+        # for each change to scan step or shape or rotation
+        # get max def values from corners and set def slider min/max
+        # foreach change in sample z or objective z get overfocus max,
+        # set minimum to minus max, calculate and set min/max objective f slider
+        # also set min/max beam radius to be in sync whatever they are
+        # could have a signal for geom changed which components could connect to
+        upper = self.sample.z - self.objective.z
+        return (None, (upper * 0.99))
+
+    def _minmax_def(self):
+        current_coord = self._scan_pixel_yx
+        ny, nx = self.sample.scan_shape
+        values = []
+        for c in (
+            (0, 0),
+            (ny, 0),
+            (0, nx),
+            (ny, nx),
+        ):
+            self.move_to(c)
+            values.append(
+                (
+                    self.scan_coils.first.defy,
+                    self.scan_coils.first.defx,
+                    self.scan_coils.second.defy,
+                    self.scan_coils.second.defx,
+                    self.descan_coils.first.defy,
+                    self.descan_coils.first.defx,
+                    self.descan_coils.second.defy,
+                    self.descan_coils.second.defx,
+                )
+            )
+        values = np.stack(values, axis=0)
+        self.move_to(current_coord)
+        return values.min(axis=0), values.max(axis=0)
+
+    def set_beam_radius_from_semiconv(self):
+        self.source.radius = self._get_radius(self.sample.semiconv_angle)
+
+    def _get_radius(self, semiconv: float):
+        return abs(self.objective.f) * np.tan(abs(semiconv))
+
+    def move_to(self, scan_pixel_yx: Tuple[int, int]):
+        self._scan_pixel_yx = scan_pixel_yx
+        scan_position = self.sample.scan_position(scan_pixel_yx)
+        centerline = (0., 0.)
+        exit_axis = self.detector.center
+
+        self.scan_coils.send_ray_through_points(
+            centerline,
+            (self.objective.ffp, *centerline),
+            (self.objective.z, *scan_position),
+        )
+        self.descan_coils.send_ray_through_points(
+            scan_position,
+            (self.descan_coils.second.z + 0.01, *exit_axis),
+            (self.descan_coils.second.z + 0.02, *exit_axis),
+        )
+
+    def scan_point(self, num_rays: int, yx: Tuple[int, int]) -> Rays:
+        self.move_to(yx)
+        return self.run_to_end(num_rays)
+
+    def scan_point_iter(
+        self, num_rays: int, yx: Tuple[int, int]
+    ) -> Generator[Rays, None, None]:
+        self.move_to(yx)
+        yield from self.run_iter(num_rays)
+
+    def scan(
+        self, num_rays: int
+    ) -> Generator[Tuple[Tuple[int, int], Rays], None, None]:
+        sy, sx = self.sample.scan_shape
+        for y in range(sy):
+            for x in range(sx):
+                pos = (y, x)
+                yield pos, self.scan_point(num_rays, pos)
+
+    def _scan_deflections(self, scan_yx: Tuple[NDArray, NDArray]) -> NDArray:
+        """
+        Compute the coil deflections which move_to would set for each
+        of the scan pixels in scan_yx, as an array of shape (8, n_positions) in order:
+
+            scan_coils.first.defy, scan_coils.first.defx,
+            scan_coils.second.defy, scan_coils.second.defx,
+            descan_coils.first.defy, descan_coils.first.defx,
+            descan_coils.second.defy, descan_coils.second.defx,
+        """
+        scan_y, scan_x = self.sample.scan_position(
+            tuple(np.asarray(c, dtype=np.float64) for c in scan_yx)
+        )
+        zeros = np.zeros_like(scan_y)
+        exit_y, exit_x = self.detector.center
+
+        scan_defs = self.scan_coils.solve_ray_through_points(
+            (zeros, zeros),
+            (self.objective.ffp, zeros, zeros),
+            (self.objective.z, scan_y, scan_x),
+        )
+        descan_defs = self.descan_coils.solve_ray_through_points(
+            (scan_y, scan_x),
+            (self.descan_coils.second.z + 0.01, exit_y, exit_x),
+            (self.descan_coils.second.z + 0.02, exit_y, exit_x),
+        )
+        return np.stack(
+            np.broadcast_arrays(*scan_defs, *descan_defs),
+            axis=0,
+        )
+
+    def _batch_size(
+        self,
+        num_rays: int,
+        chunk: Optional[int],
+        max_memory: int,
+    ) -> int:
+        if chunk is not None:
+            return max(1, int(chunk))
+        return max(1, int(max_memory // (BATCH_BYTES_PER_RAY * max(1, num_rays))))
+
+    @staticmethod
+    def _kick_batched(rays: Rays, defy: NDArray, defx: NDArray, num_rays: int):
+        # Rays for each scan position are contiguous blocks
+        # of num_rays columns, so the per-position deflection
+        # can be broadcast onto a (n_positions, num_rays) view
+        xp = rays.xp
+        rays.dx.reshape(-1, num_rays)[:] += xp.asarray(defx)[:, xp.newaxis]
+        rays.dy.reshape(-1, num_rays)[:] += xp.asarray(defy)[:, xp.newaxis]
+
+    def _trace_batched(
+        self,
+        base_rays: Rays,
+        deflections: NDArray,
+    ) -> Rays:
+        """
+        Trace a copy of base_rays for every column of deflections
+        (as returned by _scan_deflections), returning a single Rays
+        of shape (5, n_positions * num_rays) with the rays for each
+        position in contiguous blocks
+        """
+        xp = base_rays.xp
+        num_rays = base_rays.num
+        n_pos = deflections.shape[1]
+
+        rays = base_rays.new_with(
+            data=xp.tile(base_rays.data, (1, n_pos)),
+            path_length=xp.tile(base_rays.path_length, n_pos),
+        )
+        coil_defs = {
+            self.scan_coils: deflections[0:4],
+            self.descan_coils: deflections[4:8],
+        }
+        for component in self.components:
+            rays = rays.propagate_to(component.entrance_z)
+            if component in coil_defs:
+                first_defy, first_defx, second_defy, second_defx = coil_defs[component]
+                self._kick_batched(rays, first_defy, first_defx, num_rays)
+                rays = rays.new_with(location=(component, component.first))
+                rays = rays.propagate_to(component.second.entrance_z)
+                self._kick_batched(rays, second_defy, second_defx, num_rays)
+                rays = rays.new_with(location=(component, component.second))
+            else:
+                for rays in component.step(rays):
+                    pass
+        return rays
+
+    def _scan_batched_chunks(
+        self,
+        num_rays: int,
+        chunk: Optional[int] = None,
+        max_memory: int = DEFAULT_BATCH_MEMORY,
+        interfere: bool = False,
+    ) -> Generator[Tuple[int, NDArray], None, None]:
+        """
+        Yields (first_flat_index, frames) for consecutive blocks
+        of scan positions in C-order, where frames has shape
+        (n_positions_in_block, *detector.shape)
+        """
+        sy, sx = self.sample.scan_shape
+        base_rays = self.source.get_rays(num_rays, backend=self.backend)
+        xp = base_rays.xp
+        batch = self._batch_size(base_rays.num, chunk, max_memory)
+
+        for start in range(0, sy * sx, batch):
+            flat_idx = np.arange(start, min(start + batch, sy * sx))
+            deflections = self._scan_deflections(np.unravel_index(flat_idx, (sy, sx)))
+            rays = self._trace_batched(base_rays, deflections)
+            frame_idx = xp.repeat(
+                xp.arange(flat_idx.size), base_rays.num
+            )
+            frames = self.detector.get_image_stack(
+                rays,
+                frame_idx,
+                flat_idx.size,
+                interfere=interfere,
+            )
+            yield start, get_array_from_device(frames)
+
+    def scan_batched_iter(
+        self,
+        num_rays: int,
+        chunk: Optional[int] = None,
+        max_memory: int = DEFAULT_BATCH_MEMORY,
+        interfere: bool = False,
+    ) -> Generator[Tuple[Tuple[int, int], NDArray], None, None]:
+        """
+        Equivalent to imaging the rays from scan() on the detector, yielding
+        ((y, x), frame) for each scan position, but tracing the rays for many
+        scan positions together in a single vectorised pass
+
+        The source rays are generated only once, and the coil deflections for
+        all scan positions are computed as arrays rather than by calling move_to,
+        so the model state is left unchanged.
+
+        Parameters
+        ----------
+        num_rays : int
+            The (approximate) number of rays per scan position
+        chunk : Optional[int]
+            Number of scan positions to trace together, by default
+            computed from max_memory
+        max_memory : int
+            Approximate working memory budget in bytes used to choose chunk
+        interfere : bool
+            Passed to the detector to choose complex or count images
+        """
+        sy, sx = self.sample.scan_shape
+        for start, frames in self._scan_batched_chunks(
+            num_rays, chunk=chunk, max_memory=max_memory, interfere=interfere,
+        ):
+            for offset, frame in enumerate(frames):
+                y, x = divmod(start + offset, sx)
+                yield (y, x), frame
+
+    def scan_batched(
+        self,
+        num_rays: int,
+        chunk: Optional[int] = None,
+        max_memory: int = DEFAULT_BATCH_MEMORY,
+        interfere: bool = False,
+        out: Optional[NDArray] = None,
+    ) -> NDArray:
+        """
+        As scan_batched_iter but return the full 4D dataset
+        of shape (*scan_shape, *detector.shape)
+        """
+        sy, sx = self.sample.scan_shape
+        shape = (sy, sx, *self.detector.shape)
+        image_dtype = self.detector.image_dtype(interfere)
+        if out is None:
+            out = np.zeros(shape, dtype=image_dtype)
+        else:
+            assert out.shape == shape
+        flat_out = out.reshape(sy * sx, *self.detector.shape)
+        for start, frames in self._scan_batched_chunks(
+            num_rays, chunk=chunk, max_memory=max_memory, interfere=interfere,
+        ):
+            flat_out[start:start + frames.shape[0]] = frames
+        return out
+
+    def simulate_4d(
+        self,
+        num_rays: int,
+        out: Optional[Union[PathT, NDArray]] = None,
+        chunk: Optional[int] = None,
+        max_memory: int = DEFAULT_BATCH_MEMORY,
+        interfere: bool = False,
+    ):
+        """
+        Simulate the full 4D-STEM dataset of shape (*scan_shape, *detector.shape),
+        streaming each block of frames to out as soon as it is imaged so that
+        only one block (bounded by chunk / max_memory) is held in memory
+
+        Parameters
+        ----------
+        num_rays : int
+            The (approximate) number of rays per scan position
+        out : Optional[Union[PathT, NDArray]]
+            Where to write the frames. Either a path, in which case a
+            .zarr store (if zarr is installed) or otherwise an .npy
+            memory map is created, or an existing array-like of the
+            correct shape and dtype such as a numpy.memmap, h5py.Dataset
+            or zarr.Array. By default an in-memory array is returned.
+        chunk : Optional[int]
+            Number of scan positions to trace together, by default
+            computed from max_memory
+        max_memory : int
+            Approximate working memory budget in bytes used to choose chunk
+        interfere : bool
+            Passed to the detector to choose complex or count images
+
+        Returns
+        -------
+        The array-like the frames were written to
+        """
+        sy, sx = self.sample.scan_shape
+        shape = (sy, sx, *self.detector.shape)
+        image_dtype = self.detector.image_dtype(interfere)
+        if out is None:
+            out = np.zeros(shape, dtype=image_dtype)
+        elif isinstance(out, (str, os.PathLike)):
+            out = open_datacube(out, shape, image_dtype)
+        else:
+            check_datacube(out, shape, image_dtype)
+
+        # Flushing a memmap after each block stops dirty pages
+        # accumulating for the whole dataset before writeback
+        flush = getattr(out, 'flush', None)
+        for start, frames in self._scan_batched_chunks(
+            num_rays, chunk=chunk, max_memory=max_memory, interfere=interfere,
+        ):
+            write_frames(out, start, frames)
+            if flush is not None:
+                flush()
+        return out
+
+    def scan_parallel(
+        self,
+        num_rays: int,
+        executor: Optional[Executor] = None,
+        max_workers: Optional[int] = None,
+        tile: Optional[int] = None,
+        interfere: bool = False,
+        out: Optional[NDArray] = None,
+    ) -> NDArray:
+        """
+        Compute the full 4D dataset of shape (*scan_shape, *detector.shape)
+        by imaging the rays from scan() on the detector, spreading tiles
+        of consecutive scan positions across the workers of an executor
+
+        Each worker unpickles its own snapshot of the model taken when
+        this method is called, so move_to is never called on this model
+        and the frames are identical to those from the serial scan().
+
+        Parameters
+        ----------
+        num_rays : int
+            The (approximate) number of rays per scan position
+        executor : Optional[Executor]
+            A concurrent.futures.Executor to submit tiles to. By default
+            a ProcessPoolExecutor is created and shut down afterwards.
+        max_workers : Optional[int]
+            Passed to the default ProcessPoolExecutor
+        tile : Optional[int]
+            Number of scan positions per task, by default chosen to give
+            several tasks per worker for load balancing
+        interfere : bool
+            Passed to the detector to choose complex or count images
+        out : Optional[NDArray]
+            Array-like to write frames into, see simulate_4d
+        """
+        sy, sx = self.sample.scan_shape
+        n_pos = sy * sx
+        shape = (sy, sx, *self.detector.shape)
+        image_dtype = self.detector.image_dtype(interfere)
+        if out is None:
+            out = np.zeros(shape, dtype=image_dtype)
+        else:
+            check_datacube(out, shape, image_dtype)
+
+        own_executor = executor is None
+        if own_executor:
+            # Workers are spawned rather than forked as forking is not
+            # safe once threads exist, e.g. from numba parallel kernels
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        if tile is None:
+            n_workers = getattr(executor, '_max_workers', None) or os.cpu_count() or 1
+            tile = -(-n_pos // (4 * n_workers))
+        tile = max(1, int(tile))
+
+        snapshot = pickle.dumps(self)
+        try:
+            futures = {
+                executor.submit(
+                    _scan_positions_worker,
+                    snapshot,
+                    num_rays,
+                    start,
+                    min(start + tile, n_pos),
+                    interfere,
+                ): start
+                for start in range(0, n_pos, tile)
+            }
+            for future in as_completed(futures):
+                write_frames(out, futures[future], future.result())
+        finally:
+            if own_executor:
+                executor.shutdown(cancel_futures=True)
+        return out
+
+    @staticmethod
+    def gui_wrapper():
+        from .gui import STEMModelGUI
+        return STEMModelGUI
+
+
+def _scan_positions_worker(
+    snapshot: bytes,
+    num_rays: int,
+    start: int,
+    stop: int,
+    interfere: bool,
+) -> NDArray:
+    # Module-level so it can be pickled for a ProcessPoolExecutor,
+    # each call unpickles a private copy of the model so that
+    # move_to never touches a model shared with other tasks
+    model: STEMModel = pickle.loads(snapshot)
+    frames = np.zeros(
+        (stop - start, *model.detector.shape),
+        dtype=model.detector.image_dtype(interfere),
+    )
+    for idx, flat_idx in enumerate(range(start, stop)):
+        yx = divmod(flat_idx, model.sample.scan_shape[1])
+        rays = model.scan_point(num_rays, yx)
+        frames[idx] = get_array_from_device(
+            model.detector.get_image(rays, interfere=interfere)
+        )
+    return frames
@@ -42,6 +42,9 @@ class MultisliceSample(Sample):
             location=self,
         )
 
+    def linear_ops(self):
+        return None
+
     @staticmethod
     def gui_wrapper():
         from .gui import SampleGUI
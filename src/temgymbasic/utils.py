@@ -196,16 +196,20 @@ def _rotate_deg(degrees: 'Degrees', xp=np):
     return _rotate(xp.pi / 180 * degrees, xp)
 
 
-def get_pixel_coords(
-    rays_x, rays_y, shape, pixel_size, flip_y=False, scan_rotation: 'Degrees' = 0., xp=np
-):
+def get_pixel_transform(flip_y=False, scan_rotation: 'Degrees' = 0., xp=np):
     if flip_y:
         transform = _flip_y(xp)
     else:
         transform = _identity(xp)
 
     # Transformations are applied right to left
-    transform = _rotate_deg(xp.array(scan_rotation), xp) @ transform
+    return _rotate_deg(xp.array(scan_rotation), xp) @ transform
+
+
+def get_pixel_coords(
+    rays_x, rays_y, shape, pixel_size, flip_y=False, scan_rotation: 'Degrees' = 0., xp=np
+):
+    transform = get_pixel_transform(flip_y, scan_rotation, xp=xp)
 
     y_transformed, x_transformed = (xp.array((rays_y, rays_x)).T @ transform).T
 
@@ -252,6 +256,64 @@ def multi_cumsum_inplace(values, partitions, start):
             part_count += 1
 
 
+@njit(cache=True)
+def _flat_pixel_index(y, x, transform, pixel_size, sy, sx):
+    # Matches get_pixel_coords followed by rounding to the nearest
+    # pixel, returning -1 for rays which miss the detector
+    py = round((y * transform[0, 0] + x * transform[1, 0]) / pixel_size + (sy // 2))
+    px = round((y * transform[0, 1] + x * transform[1, 1]) / pixel_size + (sx // 2))
+    if 0 <= py < sy and 0 <= px < sx:
+        return py * sx + px
+    return -1
+
+
+@njit(cache=True)
+def bin_ray_counts_inplace(out, ys, xs, transform, pixel_size, sy, sx, frame_offsets):
+    """
+    Add one count to the flat image (stack) out for each ray at (ys, xs)
+    which lands on the (sy, sx) pixel grid, in a single pass over the rays
+
+    If frame_offsets is non-empty it gives an index offset per ray, used
+    to bin rays into different frames of an image stack.
+    """
+    offsets = frame_offsets.size > 0
+    for i in range(ys.size):
+        idx = _flat_pixel_index(ys[i], xs[i], transform, pixel_size, sy, sx)
+        if idx >= 0:
+            if offsets:
+                idx += frame_offsets[i]
+            out[idx] += 1
+
+
+@njit(cache=True)
+def bin_ray_wavefronts_inplace(
+    out, ys, xs, transform, pixel_size, sy, sx, frame_offsets, phases
+):
+    """
+    As bin_ray_counts_inplace but adding exp(-1j * phase) for each
+    ray into the complex image out
+    """
+    offsets = frame_offsets.size > 0
+    for i in range(ys.size):
+        idx = _flat_pixel_index(ys[i], xs[i], transform, pixel_size, sy, sx)
+        if idx >= 0:
+            if offsets:
+                idx += frame_offsets[i]
+            out[idx] += np.cos(phases[i]) - 1j * np.sin(phases[i])
+
+
+@njit(cache=True)
+def scatter_add_inplace(out, flat_icds, values):
+    for i in range(flat_icds.size):
+        out[flat_icds[i]] += values[i]
+
+
+@njit(cache=True)
+def scatter_count_inplace(out, flat_icds, value):
+    for i in range(flat_icds.size):
+        out[flat_icds[i]] += value
+
+
 def concentric_rings(
     num_points_approx: int,
     radius: float,
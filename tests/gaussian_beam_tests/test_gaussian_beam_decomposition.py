@@ -40,3 +40,49 @@ def test_gaussian_amplitude():
     amplitude = gaussian_amplitude(Qinv, A, B, xp)
 
     xp.testing.assert_allclose(amplitude, known_result, atol=1e-5)
+
+
+def gbd_rays_and_detector(n_rays=64, shape=(24, 20)):
+    from temgymbasic.model import Model
+    import temgymbasic.components as comp
+
+    model = Model((
+        comp.GaussBeam(z=0., voltage=1e3, radius=1e-4, wo=2e-5),
+        comp.Lens(z=0.1, f=0.15),
+        comp.Detector(z=0.3, pixel_size=2e-6, shape=shape),
+    ))
+    rays = tuple(model.run_iter(n_rays))
+    return rays, model.detector
+
+
+def test_gbd_tiled_matches_untiled():
+    from temgymbasic.gbd import GBD_BYTES_PER_ELEMENT
+
+    rays, detector = gbd_rays_and_detector()
+    n_gauss = rays[-1].num // 5
+    reference = detector.get_image(
+        rays, interfere=True, max_memory=2 ** 40, gbd_kernel='numpy',
+    )
+    assert np.abs(reference).max() > 0.
+
+    # Tiling over pixels only keeps the sum over beamlets unchanged
+    tiled_px = detector.get_image(
+        rays, interfere=True, max_memory=7 * n_gauss * GBD_BYTES_PER_ELEMENT,
+        gbd_kernel='numpy',
+    )
+    np.testing.assert_array_equal(tiled_px, reference)
+
+    # Tiling over beamlets too changes only the order of summation
+    tiled_gauss = detector.get_image(
+        rays, interfere=True, max_memory=5 * GBD_BYTES_PER_ELEMENT, gbd_kernel='numpy',
+    )
+    np.testing.assert_allclose(tiled_gauss, reference, rtol=1e-10, atol=1e-10)
+
+
+def test_gbd_numba_kernel_matches_numpy():
+    rays, detector = gbd_rays_and_detector()
+    reference = detector.get_image(rays, interfere=True, gbd_kernel='numpy')
+    fused = detector.get_image(rays, interfere=True, gbd_kernel='numba')
+    np.testing.assert_allclose(
+        fused, reference, rtol=1e-6, atol=1e-6 * np.abs(reference).max()
+    )
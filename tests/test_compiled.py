@@ -0,0 +1,133 @@
+import pytest
+import numpy as np
+
+from temgymbasic.model import Model, STEMModel
+from temgymbasic.compiled import LinearSegment
+import temgymbasic.components as comp
+
+
+def linear_components():
+    return (
+        comp.ParallelBeam(z=0., radius=0.01, voltage=1e3, tilt_yx=(0.01, -0.02)),
+        comp.Deflector(z=0.1, defx=0.01, defy=-0.003),
+        comp.Lens(z=0.2, f=0.15),
+        comp.DoubleDeflector(
+            first=comp.Deflector(z=0.3, defx=-0.02, defy=0.01),
+            second=comp.Deflector(z=0.35, defx=0.01, defy=-0.005),
+        ),
+        comp.ProjectorLensSystem(
+            first=comp.Lens(z=0.5, f=0.05),
+            second=comp.Lens(z=0.6, f=0.05),
+        ),
+        comp.Detector(z=1., pixel_size=0.001, shape=(64, 64)),
+    )
+
+
+def mixed_components():
+    return (
+        comp.ParallelBeam(z=0., radius=0.01, voltage=1e3),
+        comp.Lens(z=0.1, f=0.3),
+        comp.Aperture(z=0.2, radius=0.004),
+        comp.Deflector(z=0.25, defx=0.001),
+        comp.Biprism(z=0.3, deflection=0.001, rotation=20.),
+        comp.Lens(
+            z=0.4, f=0.2,
+            aber_coeffs=comp.LensAberrations(1e3, 0., 0., 0., 0.),
+        ),
+        comp.Deflector(z=0.45, defy=-0.001),
+        comp.Detector(z=0.6, pixel_size=0.001, shape=(64, 64)),
+    )
+
+
+def assert_rays_close(compiled, reference):
+    assert compiled.num == reference.num
+    assert compiled.location is reference.location
+    np.testing.assert_allclose(compiled.data, reference.data, atol=1e-12)
+    np.testing.assert_allclose(
+        compiled.path_length, reference.path_length, rtol=1e-12, atol=1e-14
+    )
+
+
+@pytest.mark.parametrize('components', [linear_components, mixed_components])
+def test_compiled_matches_run_to_end(components):
+    model = Model(components())
+    compiled = model.compile()
+    assert_rays_close(compiled.run_to_end(512), model.run_to_end(512))
+
+
+def test_compiled_linear_model_single_segment():
+    model = Model(linear_components())
+    items = model.compile().items
+    assert len(items) == 2
+    assert isinstance(items[0], LinearSegment)
+    assert items[1] is model.detector
+
+
+def test_compiled_nonlinear_components_are_stepped():
+    model = Model(mixed_components())
+    stepped = tuple(
+        item for item in model.compile().items
+        if not isinstance(item, LinearSegment)
+    )
+    assert tuple(type(c) for c in stepped) == (
+        comp.Aperture, comp.Biprism, comp.Lens, comp.Detector
+    )
+
+
+def test_compiled_invalidated_by_parameter_change():
+    model = Model(linear_components())
+    compiled = model.compile()
+    compiled.run_to_end(64)
+    assert not compiled.stale
+
+    model.components[2].f = 0.1
+    assert compiled.stale
+    assert_rays_close(compiled.run_to_end(256), model.run_to_end(256))
+
+    # Nested components of a DoubleDeflector also invalidate
+    model.components[3].second.defx = 0.05
+    assert compiled.stale
+    assert_rays_close(compiled.run_to_end(256), model.run_to_end(256))
+
+
+def test_compiled_invalidated_by_move_component():
+    model = Model(linear_components())
+    compiled = model.compile()
+    model.move_component(model.components[2], 0.25)
+    assert compiled.stale
+    assert model.compile() is compiled
+    assert_rays_close(compiled.run_to_end(256), model.run_to_end(256))
+
+
+def test_compiled_invalidated_by_add_component():
+    model = Model(linear_components())
+    compiled = model.compile()
+    model.add_component(comp.Aperture(z=0.7, radius=0.001))
+    assert compiled.stale
+    assert_rays_close(compiled.run_to_end(256), model.run_to_end(256))
+
+
+def test_compiled_stem_scan_positions():
+    model = STEMModel()
+    model.set_stem_params(scan_shape=(4, 4), overfocus=0.01)
+    compiled = model.compile()
+    for yx in ((0, 0), (3, 1), (2, 2)):
+        model.move_to(yx)
+        assert_rays_close(compiled.run_to_end(256), model.run_to_end(256))
+
+
+def test_component_version():
+    lens = comp.Lens(z=0.1, f=0.2)
+    version = lens.version
+    lens.f = 0.3
+    assert lens.version > version
+    version = lens.version
+    lens._set_z(0.2)
+    assert lens.version > version
+
+    detector = comp.AccumulatingDetector(
+        z=0.1, pixel_size=0.1, shape=(8, 8), buffer_length=2
+    )
+    version = detector.version
+    detector.buffer = np.zeros((2, 8, 8))
+    assert detector.version == version
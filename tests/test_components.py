@@ -837,3 +837,40 @@ def test_sample_phase_shift():
     # import matplotlib.pyplot as plt
     # plt.axis('equal')
     # plt.show()
+
+
+@pytest.mark.parametrize('interfere', [False, True])
+@pytest.mark.parametrize(
+    'flip_y, rotation', [(False, 0.), (True, 33.)]
+)
+def test_detector_fused_binning(interfere, flip_y, rotation):
+    n_rays = 10_000
+    rng = np.random.default_rng(42)
+    rays = Rays(
+        data=np.concatenate(
+            (rng.uniform(-0.06, 0.06, size=(4, n_rays)), np.ones((1, n_rays))),
+            axis=0,
+        ),
+        location=0.2,
+        path_length=rng.uniform(0., 1., size=n_rays),
+        wavelength=0.01,
+    )
+    detector = comp.Detector(
+        z=0.2, pixel_size=0.001, shape=(96, 80), flip_y=flip_y, rotation=rotation
+    )
+    image = detector.get_image(rays, interfere=interfere)
+
+    # Reference using unbuffered np.add.at
+    flat_icds, mask = detector._flat_pixel_indices(rays)
+    wavefronts = detector._ray_wavefronts(rays, interfere, mask)
+    reference = np.zeros(detector.shape, dtype=detector.image_dtype(interfere))
+    np.add.at(reference.ravel(), flat_icds, wavefronts)
+
+    # Some rays must miss the detector for the test to be meaningful
+    assert 0 < mask.sum() < n_rays
+    assert image.dtype == reference.dtype
+    np.testing.assert_allclose(image, reference, atol=1e-9)
+
+    scattered = np.zeros_like(reference)
+    detector.sum_rays_on_detector(scattered, flat_icds, wavefronts)
+    np.testing.assert_allclose(scattered, reference, atol=1e-9)
@@ -3,6 +3,7 @@ from typing import TypedDict
 import pytest
 import numpy as np
 
+from temgymbasic import UsageError
 from temgymbasic.model import STEMModel
 
 
@@ -212,3 +213,107 @@ def test_rays(params_update, nav_shape, sig_shape, fail) -> np.ndarray:
             else:
                 np.testing.assert_allclose(image_px_y, spec_y, rtol=1e-3, atol=1e-3)
                 np.testing.assert_allclose(image_px_x, spec_x, rtol=1e-3, atol=1e-3)
+
+
+def serial_scan_frames(model: STEMModel, num_rays: int, interfere: bool):
+    frames = [
+        model.detector.get_image(rays, interfere=interfere)
+        for _, rays in model.scan(num_rays)
+    ]
+    return np.stack(frames, axis=0).reshape(
+        *model.sample.scan_shape, *model.detector.shape
+    )
+
+
+def batched_scan_model():
+    model = STEMModel()
+    model.set_stem_params(
+        overfocus=0.01,
+        scan_shape=(5, 6),
+        scan_step_yx=(0.001, 0.0015),
+        scan_rotation=23.,
+    )
+    model.detector.shape = (16, 12)
+    model.detector.pixel_size = 0.002
+    return model
+
+
+@pytest.mark.parametrize('chunk', [1, 7, None])
+@pytest.mark.parametrize('interfere', [False, True])
+def test_scan_batched_matches_scan(chunk, interfere):
+    model = batched_scan_model()
+    cube = model.scan_batched(128, chunk=chunk, interfere=interfere)
+    reference = serial_scan_frames(model, 128, interfere)
+    assert cube.shape == reference.shape
+    assert cube.dtype == reference.dtype
+    np.testing.assert_allclose(cube, reference, atol=1e-9)
+
+
+def test_scan_batched_iter_order():
+    model = batched_scan_model()
+    cube = model.scan_batched(64, chunk=4)
+    positions = []
+    for (y, x), frame in model.scan_batched_iter(64, chunk=4):
+        positions.append((y, x))
+        np.testing.assert_array_equal(frame, cube[y, x])
+    sy, sx = model.sample.scan_shape
+    assert positions == [(y, x) for y in range(sy) for x in range(sx)]
+
+
+def test_scan_batched_leaves_model_unchanged():
+    model = batched_scan_model()
+    model.move_to((2, 3))
+    before = model._scan_deflections(([2], [3]))[:, 0]
+    model.scan_batched(32, chunk=3)
+    assert model.scan_coord == (2, 3)
+    after = (
+        model.scan_coils.first.defy, model.scan_coils.first.defx,
+        model.scan_coils.second.defy, model.scan_coils.second.defx,
+        model.descan_coils.first.defy, model.descan_coils.first.defx,
+        model.descan_coils.second.defy, model.descan_coils.second.defx,
+    )
+    np.testing.assert_allclose(after, before)
+
+
+def test_simulate_4d_memmap(tmp_path):
+    model = batched_scan_model()
+    reference = model.scan_batched(64, chunk=4)
+    path = tmp_path / 'cube.npy'
+    out = model.simulate_4d(64, out=path, chunk=4)
+    assert isinstance(out, np.memmap)
+    del out
+    np.testing.assert_array_equal(np.load(path, mmap_mode='r'), reference)
+
+
+def test_simulate_4d_existing_out():
+    model = batched_scan_model()
+    reference = model.scan_batched(64, chunk=4, interfere=True)
+    out = np.zeros_like(reference)
+    # chunk of 4 does not divide the scan row length of 6
+    result = model.simulate_4d(64, out=out, chunk=4, interfere=True)
+    assert result is out
+    np.testing.assert_array_equal(out, reference)
+
+    with pytest.raises(UsageError):
+        model.simulate_4d(64, out=np.zeros(reference.shape, dtype=np.float64))
+    with pytest.raises(UsageError):
+        model.simulate_4d(64, out=np.zeros((1, *reference.shape[1:]), dtype=np.int32))
+
+
+@pytest.mark.parametrize('interfere', [False, True])
+def test_scan_parallel_matches_scan(interfere):
+    model = batched_scan_model()
+    model.move_to((1, 2))
+    cube = model.scan_parallel(64, max_workers=2, tile=4, interfere=interfere)
+    assert model.scan_coord == (1, 2)
+    reference = serial_scan_frames(model, 64, interfere)
+    assert cube.dtype == reference.dtype
+    np.testing.assert_array_equal(cube, reference)
+
+
+def test_scan_parallel_custom_executor():
+    from concurrent.futures import ThreadPoolExecutor
+    model = batched_scan_model()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        cube = model.scan_parallel(64, executor=executor)
+    np.testing.assert_array_equal(cube, serial_scan_frames(model, 64, False))